@@ -1,14 +1,39 @@
 # api.py
-# pip install fastapi uvicorn xmltodict
+# pip install fastapi uvicorn orjson
 
-import xmltodict
+import asyncio
+import anyio
+import orjson
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Body, File, UploadFile
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, Field
 from typing import Any, Dict, List, Optional
-from tax_graph import run_tax_validation, explain_result
-from xml_utils import map_xml_to_tx  # <-- NEW
+from tax_graph import run_tax_validation, arun_tax_validation, explain_result
+from xml_utils import map_fields_to_tx
+from xml_fast_expat import extract_invoice_fields
 
-app = FastAPI(title="Tax Validation Agent API", version="0.3.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # graph runs are offloaded to anyio's worker threads; allow more than the default 40 in flight
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 64
+    yield
+
+app = FastAPI(title="Tax Validation Agent API", version="0.3.0", lifespan=lifespan, default_response_class=ORJSONResponse)
+# Starlette's gzip responder doesn't flush between body chunks, so it would hold back the whole
+# /batch NDJSON stream until the last item; streaming routes go out uncompressed.
+_UNCOMPRESSED_PATHS = frozenset({"/batch"})
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in _UNCOMPRESSED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# /explain reports run to several KB of JSON; level 1 gets most of the size win for little CPU
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024, compresslevel=1)
 
 # (optional) auto-redirect "/" -> "/docs"
 from fastapi.responses import RedirectResponse
@@ -35,32 +60,50 @@ class ValidateResponse(BaseModel):
 @app.get("/health")
 def health(): return {"status": "ok"}
 
-@app.post("/validate", response_model=ValidateResponse)
-def validate(req: ValidateRequest):
-    return run_tax_validation(req.tx, req.ctx or {})
+@app.post("/validate", responses={200: {"model": ValidateResponse}})
+async def validate(req: ValidateRequest):
+    return await anyio.to_thread.run_sync(run_tax_validation, req.tx, req.ctx or {})
 
 @app.post("/batch")
-def batch(payload: Dict[str, List[ValidateRequest]] = Body(...)):
+async def batch(payload: Dict[str, List[ValidateRequest]] = Body(...)):
+    """Streams one NDJSON line per item as it finishes (tagged with its index; {"index", "error"} if it raised), then a summary line."""
     items = payload.get("items", [])
-    results = [run_tax_validation(i.tx, i.ctx or {}) for i in items]
-    passed = sum(1 for r in results if r["passed"])
-    return {"results": results, "passed_count": passed, "failed_count": len(results)-passed}
+
+    async def run(index: int, item: ValidateRequest):
+        # the 200 is already on the wire, so a failing item becomes an error line, not an aborted stream
+        try:
+            return {"index": index, **await arun_tax_validation(item.tx, item.ctx or {})}
+        except Exception as exc:
+            return {"index": index, "error": f"{type(exc).__name__}: {exc}"}
+
+    async def ndjson():
+        tasks = [asyncio.ensure_future(run(n, i)) for n, i in enumerate(items)]
+        passed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                passed += bool(line.get("passed"))
+                yield orjson.dumps(line) + b"\n"
+        finally:
+            for t in tasks: t.cancel()
+        yield orjson.dumps({"passed_count": passed, "failed_count": len(items)-passed}) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
 @app.post("/explain")
-def explain(req: ValidateRequest):
-    report = run_tax_validation(req.tx, req.ctx or {})
+async def explain(req: ValidateRequest):
+    report = await anyio.to_thread.run_sync(run_tax_validation, req.tx, req.ctx or {})
     summary = explain_result(report)
     return {"summary": summary, "report": report}
 
 # -------- XML endpoint (NEW) --------
-@app.post("/validate/xml", response_model=ValidateResponse)
+@app.post("/validate/xml", responses={200: {"model": ValidateResponse}})
 async def validate_xml(file: UploadFile = File(...)):
-    content = await file.read()
-    doc = xmltodict.parse(content)
-    tx = map_xml_to_tx(doc)
+    tx = map_fields_to_tx(await anyio.to_thread.run_sync(extract_invoice_fields, file.file))
     ctx = {"rate_table": {"DE": 0.19}, "tolerance": 0.01}
-    return run_tax_validation(tx, ctx)
+    return await anyio.to_thread.run_sync(run_tax_validation, tx, ctx)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("api:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    # no reloader here; use `uvicorn api:app --reload` while developing, gunicorn.conf.py in production
+    uvicorn.run("api:app", host="127.0.0.1", port=8000)
\ No newline at end of file
@@ -0,0 +1,12 @@
+# gunicorn.conf.py
+# Production entry (Linux/macOS – gunicorn does not run on Windows):
+#   gunicorn api:app -c gunicorn.conf.py
+# uvicorn_worker.UvicornWorker (uvicorn.workers is deprecated) picks uvloop + httptools automatically when uvicorn[standard] is installed.
+
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2))
+worker_class = "uvicorn_worker.UvicornWorker"
+keepalive = 5
@@ -2,82 +2,106 @@
 # pip install langgraph langchain-core pydantic
 
 from __future__ import annotations
-from typing import TypedDict, Dict, Any, Optional, Literal, List
+from typing import Dict, Any, Optional, Literal, List
+from dataclasses import dataclass, field
 from langgraph.graph import StateGraph, START, END
 from langgraph.types import Command
 from datetime import date
 
 # ---------- State ----------
-class TaxState(TypedDict, total=False):
-    tx: Dict[str, Any]
-    ctx: Dict[str, Any]
-    results: Dict[str, Any]
-    last_check_passed: bool
-    pos_region: Optional[Literal["DOMESTIC","EU","NON_EU"]]
-    confidence: float
-    awaiting_human: bool
-    path: List[str]
-    last_failed_node: Optional[str]
-    messages: List[Dict[str, str]]
+# Slotted dataclass: nodes use plain attribute access instead of dict lookups, and LangGraph
+# hands every node (and router) a TaxState built from the current channel values.
+@dataclass(slots=True)
+class TaxState:
+    tx: Dict[str, Any] = field(default_factory=dict)
+    ctx: Dict[str, Any] = field(default_factory=dict)
+    results: Dict[str, Any] = field(default_factory=dict)
+    last_check_passed: bool = False
+    pos_region: Optional[Literal["DOMESTIC","EU","NON_EU"]] = None
+    confidence: float = 0.0
+    awaiting_human: bool = False
+    path: List[str] = field(default_factory=list)
+    last_failed_node: Optional[str] = None
+    messages: List[Dict[str, str]] = field(default_factory=list)
+
+def _passed(payload: Any) -> bool:
+    return bool(payload.get("passed") if isinstance(payload, dict) and "passed" in payload else payload)
 
 def ok(state: TaxState, node: str, payload: Any = True) -> TaxState:
-    state["results"] = {**state.get("results", {}), node: payload}
-    passed = payload.get("passed") if isinstance(payload, dict) and "passed" in payload else bool(payload)
-    state["last_check_passed"] = bool(passed)
-    state["path"] = [*state.get("path", []), node]
+    state.results[node] = payload
+    passed = _passed(payload)
+    state.last_check_passed = passed
+    if not passed: state.last_failed_node = node
+    state.path.append(node)
     return state
 
 # ---------- Nodes ----------
-def node_reporting_entity(state: TaxState): return ok(state, "1_reporting_entity", True)
-def node_reporting_country(state: TaxState): return ok(state, "2_reporting_country", True)
+# Controls with no logic yet are fused into one node per contiguous run, so the graph
+# pays one step instead of one per control. A fused node passes only if every control it
+# recorded passed (see node_passed). Split a control back out once it does real work.
+REPORTING_STUBS = ("1_reporting_entity", "2_reporting_country")
+TAXABILITY_STUBS = ("3_taxability_analysis", "3a_product_service_taxability", "3b_gl_taxability")
+SUPPLIER_STUBS = ("4_supplier_vat_verification", "4a_master_data")
+RECOVERABILITY_STUBS = ("6_recoverability_rate_block", "6a_vat_rate_verification", "6b_vat_recoverability")
+
+def pass_stubs(state: TaxState, names: tuple) -> TaxState:
+    for name in names: ok(state, name, True)
+    return state
+
+def node_reporting(state: TaxState): return pass_stubs(state, REPORTING_STUBS)
+
+_REQUIRED_FIELDS = ("entity_id", "doc_date", "currency", "supplier_id", "net_amount")
 
 def node_legal_and_mandatory_fields(state: TaxState):
-    required = ["entity_id", "doc_date", "currency", "supplier_id", "net_amount"]
-    tx = state.get("tx", {})
-    missing = [k for k in required if not tx.get(k)]
+    tx = state.tx
+    missing = [k for k in _REQUIRED_FIELDS if not tx.get(k)]
     return ok(state, "legal_mandatory_fields", {"passed": len(missing)==0, "missing": missing})
 
-def node_taxability_analysis(state: TaxState): return ok(state, "3_taxability_analysis", True)
-def node_product_service_taxability(state: TaxState): return ok(state, "3a_product_service_taxability", True)
-def node_gl_taxability(state: TaxState): return ok(state, "3b_gl_taxability", True)
-def node_supplier_vat_verification(state: TaxState): return ok(state, "4_supplier_vat_verification", True)
-def node_master_data(state: TaxState): return ok(state, "4a_master_data", True)
+def node_taxability_and_supplier(state: TaxState): return pass_stubs(state, TAXABILITY_STUBS + SUPPLIER_STUBS)
+
+_EU = frozenset({"AT","BE","BG","HR","CY","CZ","DK","EE","FI","FR","DE","GR","HU","IE","IT","LV","LT","LU","MT","NL","PL","PT","RO","SK","SI","ES","SE"})
 
 def node_place_of_supply(state: TaxState):
-    tx = state.get("tx", {})
+    tx = state.tx
     ship_to, supplier = tx.get("ship_to_country"), tx.get("supplier_country")
-    eu = set("AT BE BG HR CY CZ DK EE FI FR DE GR HU IE IT LV LT LU MT NL PL PT RO SK SI ES SE".split())
-    if ship_to and supplier and ship_to == supplier: region = "DOMESTIC"
-    elif ship_to in eu and supplier in eu: region = "EU"
-    else: region = "NON_EU"
-    state["pos_region"] = region
+    region = "DOMESTIC" if ship_to and ship_to == supplier else ("EU" if ship_to in _EU and supplier in _EU else "NON_EU")
+    state.pos_region = region
     return ok(state, "5_place_of_supply", {"region": region})
 
 def node_reverse_charge_inout(state: TaxState): return ok(state, "5a_reverse_charge_verification", True)
 def node_eu_intracommunity(state: TaxState): return ok(state, "5b_eu_intracommunity", True)
 def node_non_eu_foreign(state: TaxState): return ok(state, "5c_non_eu_foreign", True)
-def node_vat_recoverability_and_rate_block(state: TaxState): return ok(state, "6_recoverability_rate_block", True)
-def node_vat_rate_verification(state: TaxState): return ok(state, "6a_vat_rate_verification", True)
-def node_vat_recoverability(state: TaxState): return ok(state, "6b_vat_recoverability", True)
+def node_recoverability_and_rate(state: TaxState): return pass_stubs(state, RECOVERABILITY_STUBS)
 
-def node_invoice_comparison(state: TaxState):
-    ctx, tx = state.get("ctx", {}), state.get("tx", {})
-    rate_table = ctx.get("rate_table", {"DE": 0.19})
+_DEFAULT_RATE_TABLE = {"DE": 0.19}
+_DEFAULT_TOLERANCE = 0.02
+
+def comparison_params(tx: Dict[str, Any], ctx: Dict[str, Any]) -> tuple[float, float]:
+    """(rate, tolerance) that the invoice comparison applies to this tx/ctx."""
+    rate_table = ctx.get("rate_table", _DEFAULT_RATE_TABLE)
     country = tx.get("country") or tx.get("reporting_country")
-    rate = rate_table.get(country, 0.0)
-    net = float(tx.get("net_amount") or 0.0)
+    return rate_table.get(country, 0.0), float(ctx.get("tolerance", _DEFAULT_TOLERANCE))
+
+def _amount(tx: Dict[str, Any], key: str) -> float:
+    v = tx.get(key)
+    return float(v) if v is not None and v != "" else 0.0
+
+def node_invoice_comparison(state: TaxState):
+    tx = state.tx
+    rate, tol = comparison_params(tx, state.ctx)
+    net = _amount(tx, "net_amount")
     calc_tax = round(net * rate, 2)
-    supplier_tax = round(float(tx.get("supplier_tax") or 0.0), 2)
-    mismatch = abs(calc_tax - supplier_tax) > float(ctx.get("tolerance", 0.02))
+    supplier_tax = round(_amount(tx, "supplier_tax"), 2)
+    mismatch = abs(calc_tax - supplier_tax) > tol
     confidence = 0.98 if not mismatch else 0.6
-    state["confidence"] = confidence
+    state.confidence = confidence
     return ok(state, "7_invoice_comparison", {"passed": not mismatch, "calc_tax": calc_tax, "supplier_tax": supplier_tax, "rate": rate, "confidence": confidence})
 
 # ---------- HITL ----------
 def node_failed_controls_and_validations(state: TaxState):
-    state["awaiting_human"] = True
-    tx = state.get("tx", {})
-    defaults = state.get("ctx", {}).get("defaults", {
+    state.awaiting_human = True
+    tx = state.tx
+    defaults = state.ctx.get("defaults", {
         "doc_date": str(date.today()),
         "currency": "EUR",
         "supplier_id": "SIM-SUP",
@@ -86,75 +110,83 @@ def node_failed_controls_and_validations(state: TaxState):
         "ship_to_country": tx.get("country") or "DE",
         "supplier_country": tx.get("country") or "DE",
     })
-    last_fail = state.get("last_failed_node") or "legal_mandatory_fields"
+    last_fail = state.last_failed_node or "legal_mandatory_fields"
+    last_fail = FUSED_INTO.get(last_fail, last_fail)
     changes = {}
     if last_fail == "legal_mandatory_fields":
         for k in ("doc_date","currency","supplier_id","net_amount"):
             if not tx.get(k):
                 tx[k] = defaults.get(k); changes[k] = tx[k]
-        state["tx"] = tx
-    state["awaiting_human"] = False
-    state["results"]["8_failed_controls_hitl"] = {"approved": True,"comment": f"Remediated and resuming from {last_fail}.","changes": changes}
-    state["messages"] = [*state.get("messages", []), {"role":"assistant","content":f"HITL fixes for {last_fail}: {changes or 'no-op'}"}]
-    return Command(update=state, goto=last_fail)
+    state.awaiting_human = False
+    # re-run only the failed control on the patched tx and carry on after it, instead of replaying
+    # the graph from there; with nothing patched it would just fail again, so stop
+    resumed = bool(changes) and node_passed(NODE_FUNCS[last_fail](state), last_fail)
+    comment = f"Remediated {last_fail} and resumed after it." if resumed else f"Could not remediate {last_fail}; stopping."
+    state.results["8_failed_controls_hitl"] = {"approved": resumed,"comment": comment,"changes": changes}
+    state.messages.append({"role":"assistant","content":f"HITL fixes for {last_fail}: {changes or 'no-op'}"})
+    return Command(update=state, goto=NEXT_AFTER[last_fail] if resumed else END)
 
 # ---------- Routers ----------
+def node_passed(state: TaxState, node: str) -> bool:
+    """Whether a graph node passed: all of its controls for a fused node, else its own result."""
+    return all(_passed(state.results.get(k)) for k in FUSED_CONTROLS.get(node, (node,)))
+
 def pass_fail(state: TaxState) -> Literal["pass","fail"]:
-    state.setdefault("path", [])
-    last_key = state["path"][-1] if state["path"] else next(reversed(state.get("results", {})), None)
-    v = state.get("results", {}).get(last_key)
-    passed = v.get("passed") if isinstance(v, dict) and "passed" in v else bool(v)
-    if not passed and last_key: state["last_failed_node"] = last_key
-    return "pass" if passed else "fail"
+    last_key = state.path[-1] if state.path else next(reversed(state.results), None)
+    return "pass" if node_passed(state, FUSED_INTO.get(last_key, last_key)) else "fail"
 
 def route_pos(state: TaxState) -> Literal["DOMESTIC","EU","NON_EU"]:
-    return state.get("pos_region", "DOMESTIC")
+    return state.pos_region or "DOMESTIC"
 
 # ---------- Graph wiring ----------
-graph = StateGraph(TaxState)
-for name, func in [
-    ("1_reporting_entity", node_reporting_entity),
-    ("2_reporting_country", node_reporting_country),
+NODES = [
+    ("1_2_reporting", node_reporting),
     ("legal_mandatory_fields", node_legal_and_mandatory_fields),
-    ("3_taxability_analysis", node_taxability_analysis),
-    ("3a_product_service_taxability", node_product_service_taxability),
-    ("3b_gl_taxability", node_gl_taxability),
-    ("4_supplier_vat_verification", node_supplier_vat_verification),
-    ("4a_master_data", node_master_data),
+    ("3_4a_taxability_and_supplier", node_taxability_and_supplier),
     ("5_place_of_supply", node_place_of_supply),
     ("5a_reverse_charge_verification", node_reverse_charge_inout),
     ("5b_eu_intracommunity", node_eu_intracommunity),
     ("5c_non_eu_foreign", node_non_eu_foreign),
-    ("6_recoverability_rate_block", node_vat_recoverability_and_rate_block),
-    ("6a_vat_rate_verification", node_vat_rate_verification),
-    ("6b_vat_recoverability", node_vat_recoverability),
+    ("6_6b_recoverability_and_rate", node_recoverability_and_rate),
     ("7_invoice_comparison", node_invoice_comparison),
     ("8_failed_controls_hitl", node_failed_controls_and_validations)
-]: graph.add_node(name, func)
-
-graph.add_edge(START, "1_reporting_entity")
-graph.add_edge("1_reporting_entity","2_reporting_country")
-graph.add_conditional_edges("2_reporting_country", pass_fail, {"pass":"legal_mandatory_fields","fail":"8_failed_controls_hitl"})
-graph.add_conditional_edges("legal_mandatory_fields", pass_fail, {"pass":"3_taxability_analysis","fail":"8_failed_controls_hitl"})
-graph.add_edge("3_taxability_analysis","3a_product_service_taxability")
-graph.add_edge("3a_product_service_taxability","3b_gl_taxability")
-graph.add_edge("3b_gl_taxability","4_supplier_vat_verification")
-graph.add_conditional_edges("4_supplier_vat_verification", pass_fail, {"pass":"4a_master_data","fail":"8_failed_controls_hitl"})
-graph.add_edge("4a_master_data","5_place_of_supply")
-graph.add_conditional_edges("5_place_of_supply", route_pos, {"DOMESTIC":"5a_reverse_charge_verification","EU":"5b_eu_intracommunity","NON_EU":"5c_non_eu_foreign"})
-for edge in ["5a_reverse_charge_verification","5b_eu_intracommunity","5c_non_eu_foreign"]:
-    graph.add_edge(edge,"6_recoverability_rate_block")
-graph.add_edge("6_recoverability_rate_block","6a_vat_rate_verification")
-graph.add_edge("6a_vat_rate_verification","6b_vat_recoverability")
-graph.add_edge("6b_vat_recoverability","7_invoice_comparison")
-graph.add_conditional_edges("7_invoice_comparison", pass_fail, {"pass":END,"fail":"8_failed_controls_hitl"})
-app = graph.compile()
+]
+NODE_FUNCS = dict(NODES)
+# node -> where it goes when it passes (its pass_fail edge); HITL resumes there after a fix
+NEXT_AFTER = {
+    "1_2_reporting": "legal_mandatory_fields",
+    "legal_mandatory_fields": "3_4a_taxability_and_supplier",
+    "3_4a_taxability_and_supplier": "5_place_of_supply",
+    "7_invoice_comparison": END,
+}
+# fused graph node -> the controls it records, and the reverse
+FUSED_CONTROLS = {
+    "1_2_reporting": REPORTING_STUBS,
+    "3_4a_taxability_and_supplier": TAXABILITY_STUBS + SUPPLIER_STUBS,
+    "6_6b_recoverability_and_rate": RECOVERABILITY_STUBS,
+}
+FUSED_INTO = {name: node for node, names in FUSED_CONTROLS.items() for name in names}
+
+def build_graph():
+    graph = StateGraph(TaxState)
+    for name, func in NODES: graph.add_node(name, func)
+
+    graph.add_edge(START, "1_2_reporting")
+    for node, nxt in NEXT_AFTER.items():
+        graph.add_conditional_edges(node, pass_fail, {"pass":nxt,"fail":"8_failed_controls_hitl"})
+    graph.add_conditional_edges("5_place_of_supply", route_pos, {"DOMESTIC":"5a_reverse_charge_verification","EU":"5b_eu_intracommunity","NON_EU":"5c_non_eu_foreign"})
+    for edge in ["5a_reverse_charge_verification","5b_eu_intracommunity","5c_non_eu_foreign"]:
+        graph.add_edge(edge,"6_6b_recoverability_and_rate")
+    graph.add_edge("6_6b_recoverability_and_rate","7_invoice_comparison")
+    return graph.compile()
+
+app = build_graph()
 
 # ---------- Public helper ----------
-def run_tax_validation(tx: Dict[str,Any], ctx: Optional[Dict[str,Any]]=None)->Dict[str,Any]:
-    ctx=ctx or {}
-    init:TaxState={"tx":tx,"ctx":ctx,"results":{},"confidence":0.0,"awaiting_human":False,"path":[],"messages":[]}
-    final=app.invoke(init)
+def _initial_state(tx: Dict[str,Any], ctx: Optional[Dict[str,Any]])->Dict[str,Any]:
+    return {"tx":tx,"ctx":ctx or {},"results":{},"confidence":0.0,"awaiting_human":False,"path":[],"messages":[]}
+
+def _build_report(final: Dict[str,Any])->Dict[str,Any]:
     inv=final.get("results",{}).get("7_invoice_comparison",{})
     legal=final.get("results",{}).get("legal_mandatory_fields",{})
     pos=final.get("results",{}).get("5_place_of_supply",{})
@@ -171,6 +203,13 @@ def run_tax_validation(tx: Dict[str,Any], ctx: Optional[Dict[str,Any]]=None)->Di
         "results":final.get("results",{})
     }
 
+def run_tax_validation(tx: Dict[str,Any], ctx: Optional[Dict[str,Any]]=None)->Dict[str,Any]:
+    return _build_report(app.invoke(_initial_state(tx, ctx)))
+
+async def arun_tax_validation(tx: Dict[str,Any], ctx: Optional[Dict[str,Any]]=None)->Dict[str,Any]:
+    """Async variant of run_tax_validation, so callers can overlap several graph runs."""
+    return _build_report(await app.ainvoke(_initial_state(tx, ctx)))
+
 def explain_result(report:Dict[str,Any])->str:
     """Summarize the validation outcome in plain English."""
     if not report: return "No report generated."
@@ -0,0 +1,62 @@
+# xml_fast_expat.py
+# stdlib only (xml.parsers.expat)
+
+from __future__ import annotations
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from xml.parsers import expat
+from xml_utils import KNOWN_PATHS
+
+# Local-name path (below the document root) -> field name read by map_fields_to_tx.
+_TARGETS: Dict[Tuple[str, ...], str] = {
+    tuple(key.split(":")[-1] for key in path): field for field, path in KNOWN_PATHS.items()
+}
+
+class TargetedExtractor:
+    """
+    expat callbacks that keep a stack of local names and record the text of the
+    first element found on each target path. No tree or dict is ever built.
+    """
+
+    def __init__(self, targets: Dict[Tuple[str, ...], str] = _TARGETS):
+        self.targets = targets
+        self._leaf_names = frozenset(path[-1] for path in targets)
+        self.fields: Dict[str, Optional[str]] = {}
+        self._stack: List[str] = []
+        self._field: Optional[str] = None
+        self._depth = 0
+        self._text: List[str] = []
+
+    def start(self, name: str, attrs: Dict[str, str]) -> None:
+        local = name[name.rfind(":") + 1:]
+        self._stack.append(local)
+        if self._field is None and local in self._leaf_names:
+            field = self.targets.get(tuple(self._stack[1:]))
+            if field and field not in self.fields:
+                self._field, self._depth, self._text = field, len(self._stack), []
+
+    def chars(self, data: str) -> None:
+        if self._field is not None:
+            self._text.append(data)
+
+    def end(self, name: str) -> None:
+        if self._field is not None and len(self._stack) == self._depth:
+            self.fields[self._field] = "".join(self._text).strip() or None
+            self._field = None
+        self._stack.pop()
+
+def extract_invoice_fields(data: bytes | BinaryIO) -> Dict[str, Optional[str]]:
+    """
+    Parse an Invoice XML (bytes or a binary file object, read incrementally) and
+    return only the leaf values we map into tx. Namespaces are ignored and the first match wins.
+    """
+    extractor = TargetedExtractor()
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = extractor.start
+    parser.CharacterDataHandler = extractor.chars
+    parser.EndElementHandler = extractor.end
+    if isinstance(data, (bytes, bytearray)):
+        parser.Parse(data, True)
+    else:
+        parser.ParseFile(data)
+    return extractor.fields
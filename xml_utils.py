@@ -1,27 +1,39 @@
-# pip install xmltodict
-
 from __future__ import annotations
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
+
+# Field name -> tag path (relative to the Invoice element) read by map_xml_to_tx.
+KNOWN_PATHS: Dict[str, Tuple[str, ...]] = {
+    "IssueDate": ("cbc:IssueDate",),
+    "DocumentCurrencyCode": ("cbc:DocumentCurrencyCode",),
+    "TaxExclusiveAmount": ("LegalMonetaryTotal", "TaxExclusiveAmount"),
+    "TaxAmount": ("TaxTotal", "TaxAmount"),
+    "CompanyID": ("AccountingSupplierParty", "Party", "PartyLegalEntity", "CompanyID"),
+    "SupplierID": ("AccountingSupplierParty", "SupplierID"),
+}
+
+def _compile_path(path: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
+    """Pair every key with its namespaceless form once, instead of splitting on each lookup."""
+    return tuple((key, key.split(":")[-1]) for key in path)
 
-def _get(d: Dict[str, Any], path: list[str], default=None):
+_PATH_PLANS = {field: _compile_path(path) for field, path in KNOWN_PATHS.items()}
+
+def _get(d: Dict[str, Any], plan: Tuple[Tuple[str, str], ...], default=None):
     """
     Safe nested get supporting namespaced tags: tries exact key,
     then falls back to matching the suffix after ':'.
     """
     cur = d
-    for key in path:
+    for key, plain in plan:
         if not isinstance(cur, dict):
             return default
         if key in cur:
             cur = cur[key]
             continue
         # fall back to namespaceless match
-        plain = key.split(":")[-1]
-        matches = [k for k in cur.keys() if k.split(":")[-1] == plain]
-        if matches:
-            cur = cur[matches[0]]
-        else:
+        match = next((k for k in cur if k == plain or k.endswith(":" + plain)), None)
+        if match is None:
             return default
+        cur = cur[match]
     return cur
 
 def _to_number(v, default=0.0) -> float:
@@ -37,34 +49,24 @@ def _to_number(v, default=0.0) -> float:
 def map_xml_to_tx(doc: Dict[str, Any]) -> Dict[str, Any]:
     """
     Map a UBL/Peppol-like Invoice XML (already parsed via xmltodict) into our tx schema.
-    Adjust paths if your XML uses different tags.
+    Adjust KNOWN_PATHS if your XML uses different tags.
     """
     inv = doc.get("Invoice") or doc.get("ns:Invoice") or doc
+    return map_fields_to_tx({field: _get(inv, plan) for field, plan in _PATH_PLANS.items()})
 
-    issue_date = _get(inv, ["cbc:IssueDate"]) or _get(inv, ["IssueDate"])
-    currency = _get(inv, ["cbc:DocumentCurrencyCode"]) or _get(inv, ["DocumentCurrencyCode"]) or "EUR"
-
-    tax_total = _get(inv, ["TaxTotal"]) or {}
-    legal_monetary = _get(inv, ["LegalMonetaryTotal"]) or {}
-
-    net_amount = _to_number(_get(legal_monetary, ["TaxExclusiveAmount"]))
-    supplier_tax = _to_number(_get(tax_total, ["TaxAmount"]))
-
-    supplier_id = (
-        _get(inv, ["AccountingSupplierParty","Party","PartyLegalEntity","CompanyID"]) or
-        _get(inv, ["AccountingSupplierParty","SupplierID"]) or
-        "SUPP-UNKNOWN"
-    )
-
+def map_fields_to_tx(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Map the flat leaf values of an Invoice (see xml_fast_expat.extract_invoice_fields) into our tx schema.
+    """
     # Defaults for demo – adjust if you want to derive from address nodes
     return {
         "entity_id": "DE01",
         "country": "DE",
-        "doc_date": issue_date,
-        "currency": currency,
-        "supplier_id": supplier_id,
-        "net_amount": net_amount,
-        "supplier_tax": supplier_tax,
+        "doc_date": fields.get("IssueDate"),
+        "currency": fields.get("DocumentCurrencyCode") or "EUR",
+        "supplier_id": fields.get("CompanyID") or fields.get("SupplierID") or "SUPP-UNKNOWN",
+        "net_amount": _to_number(fields.get("TaxExclusiveAmount")),
+        "supplier_tax": _to_number(fields.get("TaxAmount")),
         "ship_to_country": "DE",
         "supplier_country": "DE",
-    }
\ No newline at end of file
+    }